@@ -8,7 +8,7 @@
 # pyre-strict
 
 import unittest
-from typing import cast, List, Optional
+from typing import cast, Dict, List, Optional, Tuple
 
 import torch
 from torch import nn
@@ -68,6 +68,32 @@ class TWSharder(EmbeddingBagCollectionSharder, ModuleSharder[nn.Module]):
 
 
 class TestEmbeddingShardingPlanner(unittest.TestCase):
+    _model_4: TestSparseNN
+    _model_3: TestSparseNN
+    _model_never_fit: TestSparseNN
+    _model_single: TestSparseNN
+
+    @classmethod
+    def setUpClass(cls) -> None:
+        def _build_model(
+            num_tables: int, num_embeddings: int, embedding_dim: int
+        ) -> TestSparseNN:
+            tables = [
+                EmbeddingBagConfig(
+                    num_embeddings=num_embeddings,
+                    embedding_dim=embedding_dim,
+                    name="table_" + str(i),
+                    feature_names=["feature_" + str(i)],
+                )
+                for i in range(num_tables)
+            ]
+            return TestSparseNN(tables=tables, sparse_device=torch.device("meta"))
+
+        cls._model_4 = _build_model(4, 100, 64)
+        cls._model_3 = _build_model(3, 100, 64)
+        cls._model_never_fit = _build_model(2, 10000000, 10000000)
+        cls._model_single = _build_model(1, 4096, 128)
+
     def setUp(self) -> None:
         compute_device = "cuda"
         self.topology = Topology(
@@ -76,16 +102,7 @@ class TestEmbeddingShardingPlanner(unittest.TestCase):
         self.planner = EmbeddingShardingPlanner(topology=self.topology)
 
     def test_tw_solution(self) -> None:
-        tables = [
-            EmbeddingBagConfig(
-                num_embeddings=100,
-                embedding_dim=64,
-                name="table_" + str(i),
-                feature_names=["feature_" + str(i)],
-            )
-            for i in range(4)
-        ]
-        model = TestSparseNN(tables=tables, sparse_device=torch.device("meta"))
+        model = self._model_4
         sharding_plan = self.planner.plan(module=model, sharders=[TWvsRWSharder()])
         expected_ranks = [[0], [0], [1], [1]]
         ranks = [
@@ -98,16 +115,7 @@ class TestEmbeddingShardingPlanner(unittest.TestCase):
         self.assertEqual(sorted(expected_ranks), sorted(ranks))
 
     def test_hidden_rw_solution(self) -> None:
-        tables = [
-            EmbeddingBagConfig(
-                num_embeddings=100,
-                embedding_dim=64,
-                name="table_" + str(i),
-                feature_names=["feature_" + str(i)],
-            )
-            for i in range(3)
-        ]
-        model = TestSparseNN(tables=tables, sparse_device=torch.device("meta"))
+        model = self._model_3
         sharding_plan = self.planner.plan(module=model, sharders=[TWvsRWSharder()])
         expected_ranks = [[0], [0, 1], [1]]
         ranks = [
@@ -120,16 +128,7 @@ class TestEmbeddingShardingPlanner(unittest.TestCase):
         self.assertEqual(sorted(expected_ranks), sorted(ranks))
 
     def test_never_fit(self) -> None:
-        tables = [
-            EmbeddingBagConfig(
-                num_embeddings=10000000,
-                embedding_dim=10000000,
-                name="table_" + str(i),
-                feature_names=["feature_" + str(i)],
-            )
-            for i in range(2)
-        ]
-        model = TestSparseNN(tables=tables, sparse_device=torch.device("meta"))
+        model = self._model_never_fit
 
         with self.assertRaises(PlannerError) as context:
             self.planner.plan(module=model, sharders=[TWvsRWSharder()])
@@ -141,16 +140,7 @@ class TestEmbeddingShardingPlanner(unittest.TestCase):
         self.assertEqual(self.planner._num_proposals, 0)
 
     def test_fail_then_rerun(self) -> None:
-        tables = [
-            EmbeddingBagConfig(
-                num_embeddings=4096,
-                embedding_dim=128,
-                name="table_" + str(i),
-                feature_names=["feature_" + str(i)],
-            )
-            for i in range(1)
-        ]
-        model = TestSparseNN(tables=tables, sparse_device=torch.device("meta"))
+        model = self._model_single
 
         with self.assertRaises(PlannerError) as context:
             self.planner.plan(module=model, sharders=[TWSharder()])
@@ -170,16 +160,7 @@ class TestEmbeddingShardingPlanner(unittest.TestCase):
         self.assertEqual(sorted(expected_ranks), sorted(ranks))
 
     def test_no_sharders(self) -> None:
-        tables = [
-            EmbeddingBagConfig(
-                num_embeddings=100,
-                embedding_dim=64,
-                name="table_" + str(i),
-                feature_names=["feature_" + str(i)],
-            )
-            for i in range(4)
-        ]
-        model = TestSparseNN(tables=tables, sparse_device=torch.device("meta"))
+        model = self._model_4
         sharding_plan = self.planner.plan(module=model, sharders=[])
 
         self.assertEqual(sharding_plan, ShardingPlan({}))
@@ -304,8 +285,15 @@ class TestEmbeddingShardingPlannerWithConstraints(unittest.TestCase):
 
 
 class TestEmbeddingShardingHashPlannerContextInputs(unittest.TestCase):
-
-    def setUp(self) -> None:
+    topology: Topology
+    batch_size: int
+    enumerator: EmbeddingEnumerator
+    storage_reservation: HeuristicalStorageReservation
+    perf_model: NoopPerfModel
+    constraints: Dict[str, ParameterConstraints]
+
+    @classmethod
+    def setUpClass(cls) -> None:
         eb_config = EmbeddingBagConfig(
             name="table_0",
             embedding_dim=160,
@@ -322,27 +310,27 @@ class TestEmbeddingShardingHashPlannerContextInputs(unittest.TestCase):
         )
         sharders = [EmbeddingBagCollectionSharder()]
 
-        self.topology = Topology(
+        cls.topology = Topology(
             local_world_size=8,
             world_size=1,
             compute_device="cuda",
         )
-        self.batch_size = 128
-        self.enumerator = EmbeddingEnumerator(
-            topology=self.topology, batch_size=self.batch_size
+        cls.batch_size = 128
+        cls.enumerator = EmbeddingEnumerator(
+            topology=cls.topology, batch_size=cls.batch_size
         )
-        self.enumerator.enumerate(module, sharders)  # pyre-ignore
+        cls.enumerator.enumerate(module, sharders)  # pyre-ignore
 
-        self.storage_reservation = HeuristicalStorageReservation(percentage=0.15)
-        self.perf_model = NoopPerfModel(topology=self.topology)
-        self.constraints = {"table1": ParameterConstraints()}
+        cls.storage_reservation = HeuristicalStorageReservation(percentage=0.15)
+        cls.perf_model = NoopPerfModel(topology=cls.topology)
+        cls.constraints = {"table1": ParameterConstraints()}
 
-        self.storage_reservation.reserve(
-            topology=self.topology,
-            batch_size=self.batch_size,
+        cls.storage_reservation.reserve(
+            topology=cls.topology,
+            batch_size=cls.batch_size,
             module=module,
             sharders=sharders,  # pyre-ignore
-            constraints=self.constraints,
+            constraints=cls.constraints,
         )
 
     def test_hash_equality(self) -> None:
@@ -468,6 +456,34 @@ class TestAutoPlannerWithScaleupProposer(unittest.TestCase):
             {EmbeddingComputeKernel.FUSED_UVM_CACHING.value}, compute_kernels
         )
 
+    def _plan_with_virtual_table(
+        self,
+        tables: List[EmbeddingConfig],
+        constraints: Dict[str, ParameterConstraints],
+        sharders: Optional[List[ModuleSharder[nn.Module]]] = None,
+    ) -> Tuple[ShardingPlan, List[str]]:
+        topology = Topology(
+            world_size=2,
+            hbm_cap=1024 * 1024 * 1024 * 2,
+            ddr_cap=1024 * 1024 * 1024 * 256,
+            compute_device="cuda",
+        )
+        planner = EmbeddingShardingPlanner(
+            topology=topology,
+            proposer=EmbeddingOffloadScaleupProposer(),
+            constraints=constraints,
+        )
+        sharding_plan = planner.plan(
+            module=TestSparseNN(tables=tables, sparse_device=torch.device("meta")),
+            sharders=(
+                sharders
+                if sharders is not None
+                else [EmbeddingCollectionSharder()]  # pyre-ignore
+            ),
+        )
+        stats: List[str] = cast(EmbeddingStats, planner._stats[0])._stats_table
+        return sharding_plan, stats
+
     def test_planner_with_virtual_table(self) -> None:
         table_count = 4
         tables = [
@@ -489,7 +505,6 @@ class TestAutoPlannerWithScaleupProposer(unittest.TestCase):
             )
             for i in range(table_count // 2, table_count)
         ]
-        model = TestSparseNN(tables=tables, sparse_device=torch.device("meta"))
 
         constraints = {
             **{
@@ -507,23 +522,7 @@ class TestAutoPlannerWithScaleupProposer(unittest.TestCase):
             },
         }
 
-        topology = Topology(
-            world_size=2,
-            hbm_cap=1024 * 1024 * 1024 * 2,
-            ddr_cap=1024 * 1024 * 1024 * 256,
-            compute_device="cuda",
-        )
-
-        planner = EmbeddingShardingPlanner(
-            topology=topology,
-            proposer=EmbeddingOffloadScaleupProposer(),
-            constraints=constraints,
-        )
-
-        sharding_plan = planner.plan(
-            module=model,
-            sharders=[EmbeddingCollectionSharder()],  # pyre-ignore
-        )
+        sharding_plan, stats = self._plan_with_virtual_table(tables, constraints)
 
         for table_index in range(4):
             # pyre-ignore
@@ -544,7 +543,6 @@ class TestAutoPlannerWithScaleupProposer(unittest.TestCase):
                 shards[1].shard_sizes,
                 [562949951477760 if table_index < 2 else 50_000, 64],
             )
-        stats: List[str] = cast(EmbeddingStats, planner._stats[0])._stats_table
         # L1 cache size is 64GB per shard and L2 cache size is 128MB per shard per table
         self.assertTrue(
             any(
@@ -584,21 +582,7 @@ class TestAutoPlannerWithScaleupProposer(unittest.TestCase):
             },
         }
 
-        topology = Topology(
-            world_size=2,
-            hbm_cap=1024 * 1024 * 1024 * 2,
-            ddr_cap=1024 * 1024 * 1024 * 256,
-            compute_device="cuda",
-        )
-
-        planner = EmbeddingShardingPlanner(
-            topology=topology,
-            proposer=EmbeddingOffloadScaleupProposer(),
-            constraints=constraints,
-        )
-        sharding_plan = planner.plan(
-            module=model, sharders=[EmbeddingCollectionSharder()]  # pyre-ignore
-        )
+        sharding_plan, stats = self._plan_with_virtual_table(tables, constraints)
 
         expected_ranks = [[0, 1], [0, 1], [0, 1], [0, 1]]
         ranks = [
@@ -640,7 +624,6 @@ class TestAutoPlannerWithScaleupProposer(unittest.TestCase):
                 shards[1].shard_sizes,
                 [562949951477760 if table_index < 2 else 50_000, 64],
             )
-        stats: List[str] = cast(EmbeddingStats, planner._stats[0])._stats_table
         # L1 cache size is 64GB per shard and L2 cache size is 128MB per shard per table
         self.assertTrue(
             any(
@@ -661,63 +644,6 @@ class TestAutoPlannerWithScaleupProposer(unittest.TestCase):
             any("Min HBM: 0.256 GB on ranks [0, 1]" in line for line in stats)
         )
 
-        constraints = {
-            **{
-                f"table_{i}": ParameterConstraints(
-                    sharding_types=["row_wise"],
-                    compute_kernels=["dram_virtual_table"],
-                    key_value_params=KeyValueParams(
-                        l2_cache_size=64, max_l1_cache_size=128
-                    ),
-                )
-                for i in range(table_count // 2)
-            },
-            **{
-                f"table_{i}": ParameterConstraints(
-                    cache_params=CacheParams(algorithm=CacheAlgorithm.LRU),
-                )
-                for i in range(table_count // 2, table_count)
-            },
-        }
-
-        topology = Topology(
-            world_size=2,
-            hbm_cap=1024 * 1024 * 1024 * 2,
-            ddr_cap=1024 * 1024 * 1024 * 256,
-            compute_device="cuda",
-        )
-
-        planner = EmbeddingShardingPlanner(
-            topology=topology,
-            proposer=EmbeddingOffloadScaleupProposer(),
-            constraints=constraints,
-        )
-        sharding_plan = planner.plan(
-            module=model, sharders=[EmbeddingCollectionSharder()]  # pyre-ignore
-        )
-
-        expected_ranks = [[0, 1], [0, 1], [0, 1], [0, 1]]
-        ranks = [
-            cast(List[int], param_shard.ranks)
-            for param_shard in cast(
-                EmbeddingModuleShardingPlan, sharding_plan.plan["sparse.ec"]
-            ).values()
-        ]
-        compute_kernels = {
-            param_shard.compute_kernel
-            for param_shard in cast(
-                EmbeddingModuleShardingPlan, sharding_plan.plan["sparse.ec"]
-            ).values()
-        }
-        self.assertEqual(sorted(expected_ranks), sorted(ranks))
-        self.assertSetEqual(
-            {
-                EmbeddingComputeKernel.DRAM_VIRTUAL_TABLE.value,
-                EmbeddingComputeKernel.FUSED_UVM_CACHING.value,
-            },
-            compute_kernels,
-        )
-
         tables = [
             EmbeddingConfig(
                 num_embeddings=10000,
@@ -738,19 +664,9 @@ class TestAutoPlannerWithScaleupProposer(unittest.TestCase):
             for i in range(table_count // 2, table_count)
         ]
 
-        model = TestSparseNN(tables=tables, sparse_device=torch.device("meta"))
-
-        planner = EmbeddingShardingPlanner(
-            topology=topology,
-            proposer=EmbeddingOffloadScaleupProposer(),
-            constraints=constraints,
-        )
-
         #  L1 cache size > size of embedding table * default cache load factor
+        sharding_plan, stats = self._plan_with_virtual_table(tables, constraints)
 
-        sharding_plan = planner.plan(
-            module=model, sharders=[EmbeddingCollectionSharder()]  # pyre-ignore
-        )
         for table_index in range(4):
             shards = sharding_plan.plan["sparse.ec"][
                 f"table_{table_index}"
@@ -769,7 +685,6 @@ class TestAutoPlannerWithScaleupProposer(unittest.TestCase):
                 shards[1].shard_sizes,
                 [5000 if table_index < 2 else 50_000, 64],
             )
-        stats: List[str] = cast(EmbeddingStats, planner._stats[0])._stats_table
         # L1 cache size of 64GB > size of embedding table * cache load factor. We use the smaller value.
         # L2 cache size is 128MB per shard per table
         self.assertTrue(
@@ -792,15 +707,13 @@ class TestAutoPlannerWithScaleupProposer(unittest.TestCase):
         )
 
         # Override cache load factor
-        planner = EmbeddingShardingPlanner(
-            topology=topology,
-            proposer=EmbeddingOffloadScaleupProposer(),
-            constraints=constraints,
-        )
-        sharding_plan = planner.plan(
-            module=model,
-            sharders=[  # pyre-ignore
-                EmbeddingCollectionSharder(fused_params={"cache_load_factor": 0.5})
+        sharding_plan, stats = self._plan_with_virtual_table(
+            tables,
+            constraints,
+            sharders=[
+                EmbeddingCollectionSharder(  # pyre-ignore
+                    fused_params={"cache_load_factor": 0.5}
+                )
             ],
         )
         for table_index in range(4):
@@ -821,7 +734,6 @@ class TestAutoPlannerWithScaleupProposer(unittest.TestCase):
                 shards[1].shard_sizes,
                 [5000 if table_index < 2 else 50_000, 64],
             )
-        stats: List[str] = cast(EmbeddingStats, planner._stats[0])._stats_table
         # L1 cache size of 64GB > size of embedding table * cache load factor. We use the smaller value.
         # L2 cache size is 128MB per shard per table
         self.assertTrue(
@@ -438,9 +438,9 @@ class ModelInput(Pipelineable):
         offsets = None
         weights = torch.rand((indices.numel(),), device=device) if weighted else None
         if use_offsets:
-            offsets = torch.cat(
-                [torch.tensor([0], device=device), lengths.cumsum(0)]
-            ).to(offsets_dtype)
+            offsets = torch.nn.functional.pad(lengths.cumsum(0), (1, 0)).to(
+                offsets_dtype
+            )
             lengths = None
         return KeyedJaggedTensor(features, indices, weights, lengths, offsets)
 
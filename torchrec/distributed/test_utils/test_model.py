@@ -7,10 +7,11 @@
 
 # pyre-strict
 
-import copy
+import functools
+import itertools
 import random
 from dataclasses import dataclass
-from typing import Any, cast, Dict, List, Optional, Tuple, Type, Union
+from typing import Any, cast, Dict, List, Optional, Sequence, Tuple, Type, Union
 
 import torch
 import torch.nn as nn
@@ -56,6 +57,7 @@ from torchrec.modules.mc_embedding_modules import ManagedCollisionEmbeddingBagCo
 from torchrec.modules.mc_modules import (
     DistanceLFU_EvictionPolicy,
     ManagedCollisionCollection,
+    ManagedCollisionModule,
     MCHManagedCollisionModule,
 )
 from torchrec.modules.regroup import KTRegroupAsDict
@@ -63,6 +65,80 @@ from torchrec.sparse.jagged_tensor import _to_offsets, KeyedJaggedTensor, KeyedT
 from torchrec.streamable import Pipelineable
 
 
+def _jagged_gather_index(offsets: torch.Tensor, indices: torch.Tensor) -> torch.Tensor:
+    """
+    Returns the flat positions of the jagged rows `indices` (delimited by
+    `offsets`), in order, so they can be gathered with a single index_select.
+    """
+    starts = offsets[indices]
+    row_lengths = offsets[indices + 1] - starts
+    num_values = int(row_lengths.sum())
+    # Output position j of row r maps to starts[r] + (j - output_start[r]).
+    return torch.repeat_interleave(
+        starts - _to_offsets(row_lengths)[:-1], row_lengths, output_size=num_values
+    ) + torch.arange(num_values, device=offsets.device)
+
+
+@dataclass(frozen=True)
+class _FeatureSchema:
+    idlist_features: List[str]
+    idscore_features: List[str]
+    idlist_ind_ranges: List[int]
+    idscore_ind_ranges: List[int]
+    idlist_pooling_factor: List[int]
+    idlist_max_lengths: List[Optional[int]]
+
+
+def _derive_feature_schema(
+    tables: Sequence[BaseEmbeddingConfig],
+    weighted_tables: Sequence[BaseEmbeddingConfig],
+    tables_pooling: Optional[List[int]],
+    max_feature_lengths: Optional[List[int]],
+) -> _FeatureSchema:
+    """
+    Derives the per-feature generation schema of `ModelInput.generate`.
+    """
+    # feature -> (num_embeddings, max_length, pooling_factor), in one pass.
+    idlist_features_to_meta = {}
+    feature_idx = 0
+    for idx, table in enumerate(tables):
+        num_embeddings = (
+            table.num_embeddings_post_pruning
+            if table.num_embeddings_post_pruning is not None
+            else table.num_embeddings
+        )
+        pooling_factor = tables_pooling[idx] if tables_pooling is not None else None
+        for feature in table.feature_names:
+            idlist_features_to_meta[feature] = (
+                num_embeddings,
+                max_feature_lengths[feature_idx] if max_feature_lengths else None,
+                pooling_factor,
+            )
+            feature_idx += 1
+
+    return _FeatureSchema(
+        idlist_features=list(idlist_features_to_meta.keys()),
+        idscore_features=[
+            feature for table in weighted_tables for feature in table.feature_names
+        ],
+        idlist_ind_ranges=[meta[0] for meta in idlist_features_to_meta.values()],
+        idscore_ind_ranges=[
+            (
+                table.num_embeddings_post_pruning
+                if table.num_embeddings_post_pruning is not None
+                else table.num_embeddings
+            )
+            for table in weighted_tables
+        ],
+        idlist_pooling_factor=(
+            [cast(int, meta[2]) for meta in idlist_features_to_meta.values()]
+            if tables_pooling is not None
+            else []
+        ),
+        idlist_max_lengths=[meta[1] for meta in idlist_features_to_meta.values()],
+    )
+
+
 @dataclass
 class ModelInput(Pipelineable):
     float_features: torch.Tensor
@@ -108,12 +184,14 @@ class ModelInput(Pipelineable):
         """
         if random_seed is not None:
             torch.manual_seed(random_seed)
+        global_batch_size = batch_size * world_size
         batch_size_by_rank = [batch_size] * world_size
         if variable_batch_size:
-            batch_size_by_rank = [
-                batch_size_by_rank[r] - r if batch_size_by_rank[r] - r > 0 else 1
-                for r in range(world_size)
-            ]
+            batch_size_by_rank = (
+                (torch.full((world_size,), batch_size) - torch.arange(world_size))
+                .clamp_min(1)
+                .tolist()
+            )
 
         def _validate_pooling_factor(
             tables: Union[
@@ -132,193 +210,228 @@ class ModelInput(Pipelineable):
         _validate_pooling_factor(tables, tables_pooling)
         _validate_pooling_factor(weighted_tables, weighted_tables_pooling)
 
-        idlist_features_to_num_embeddings = {}
-        idlist_features_to_pooling_factor = {}
-        idlist_features_to_max_length = {}
-        feature_idx = 0
-        for idx in range(len(tables)):
-            for feature in tables[idx].feature_names:
-                idlist_features_to_num_embeddings[feature] = (
-                    tables[idx].num_embeddings_post_pruning
-                    if tables[idx].num_embeddings_post_pruning is not None
-                    else tables[idx].num_embeddings
-                )
-                idlist_features_to_max_length[feature] = (
-                    max_feature_lengths[feature_idx] if max_feature_lengths else None
-                )
-                if tables_pooling is not None:
-                    idlist_features_to_pooling_factor[feature] = tables_pooling[idx]
-                feature_idx += 1
-
-        idlist_features = list(idlist_features_to_num_embeddings.keys())
-        idscore_features = [
-            feature for table in weighted_tables for feature in table.feature_names
-        ]
+        schema = _derive_feature_schema(
+            tables, weighted_tables, tables_pooling, max_feature_lengths
+        )
+        idlist_features = schema.idlist_features
+        idscore_features = schema.idscore_features
+        idlist_ind_ranges = schema.idlist_ind_ranges
+        idscore_ind_ranges = schema.idscore_ind_ranges
+        idlist_pooling_factor = schema.idlist_pooling_factor
+        idscore_pooling_factor = weighted_tables_pooling
+        idlist_max_lengths = schema.idlist_max_lengths
 
-        idlist_ind_ranges = list(idlist_features_to_num_embeddings.values())
-        idscore_ind_ranges = [
+        # Zeroes out the padded tail of each rank's batch; shared by all features.
+        variable_batch_mask = (
             (
-                table.num_embeddings_post_pruning
-                if table.num_embeddings_post_pruning is not None
-                else table.num_embeddings
+                torch.arange(batch_size).unsqueeze(0)
+                < torch.tensor(batch_size_by_rank).unsqueeze(1)
+            ).view(-1)
+            if variable_batch_size
+            else None
+        )
+
+        def _mask_variable_batch(lengths_: torch.Tensor) -> torch.Tensor:
+            if variable_batch_mask is None:
+                return lengths_
+            return torch.where(variable_batch_mask, lengths_, 0)
+
+        def _generate_indices(
+            lengths: torch.Tensor, ind_ranges: List[int]
+        ) -> Tuple[torch.Tensor, List[int]]:
+            # Lengths are drawn on host, so sizing the indices never waits on
+            # the device; they are moved to `device` once sizing is done.
+            num_indices_per_feature = lengths.sum(dim=1).tolist()
+            num_indices = sum(num_indices_per_feature)
+            if not randomize_indices:
+                indices = torch.zeros(
+                    (num_indices,),
+                    dtype=indices_dtype,
+                    device=device,
+                )
+            else:
+                # Draw all features' indices at once, scaling uniform samples by
+                # each feature's own range so every feature stays uniform.
+                indices = (
+                    torch.rand(num_indices, dtype=torch.double, device=device)
+                    * torch.repeat_interleave(
+                        torch.tensor(ind_ranges, dtype=torch.double, device=device),
+                        torch.tensor(num_indices_per_feature, device=device),
+                        output_size=num_indices,
+                    )
+                ).to(indices_dtype)
+            return indices, num_indices_per_feature
+
+        def _cat(tensors: List[torch.Tensor]) -> torch.Tensor:
+            return tensors[0] if len(tensors) == 1 else torch.cat(tensors)
+
+        def _build_kjt(
+            keys: List[str],
+            values: List[torch.Tensor],
+            lengths: List[torch.Tensor],
+            offsets: List[torch.Tensor],
+            weights: Optional[List[torch.Tensor]] = None,
+        ) -> KeyedJaggedTensor:
+            # Only the jagged layout the KJT is built from gets concatenated.
+            return KeyedJaggedTensor(
+                keys=keys,
+                values=_cat(values),
+                offsets=_cat(offsets) if use_offsets else None,
+                lengths=_cat(lengths) if not use_offsets else None,
+                weights=_cat(weights) if weights is not None else None,
             )
-            for table in weighted_tables
-        ]
 
-        idlist_pooling_factor = list(idlist_features_to_pooling_factor.values())
-        idscore_pooling_factor = weighted_tables_pooling
-        idlist_max_lengths = list(idlist_features_to_max_length.values())
+        def _rank_offsets(lengths: torch.Tensor) -> List[List[int]]:
+            # Per-feature boundaries of each rank's slice of the indices, taken
+            # once from the host-side lengths rather than per rank per feature.
+            return torch.nn.functional.pad(
+                lengths.view(lengths.size(0), world_size, -1).sum(dim=2).cumsum(dim=1),
+                (1, 0),
+            ).tolist()
 
         # Generate global batch.
         global_idlist_lengths = []
         global_idlist_indices = []
         global_idlist_offsets = []
+        global_idlist_rank_offsets: List[List[int]] = []
+        # Feature-major tensors that the per-feature lists above are views of;
+        # the global KJT is built from these directly, without a torch.cat.
+        idlist_values: Optional[torch.Tensor] = None
+        idlist_lengths: Optional[torch.Tensor] = None
+        idlist_offsets: Optional[torch.Tensor] = None
 
         global_idscore_lengths = []
         global_idscore_indices = []
         global_idscore_offsets = []
         global_idscore_weights = []
-
-        for idx in range(len(idlist_ind_ranges)):
-            ind_range = idlist_ind_ranges[idx]
-
+        global_idscore_rank_offsets: List[List[int]] = []
+        idscore_values: Optional[torch.Tensor] = None
+        idscore_lengths: Optional[torch.Tensor] = None
+        idscore_offsets: Optional[torch.Tensor] = None
+        idscore_weights: Optional[torch.Tensor] = None
+        has_idscore = bool(idscore_ind_ranges)
+
+        if idlist_ind_ranges:
             if idlist_pooling_factor:
-                lengths_ = torch.max(
-                    torch.normal(
-                        idlist_pooling_factor[idx],
-                        idlist_pooling_factor[idx] / 10,
-                        [batch_size * world_size],
-                        device=device,
-                    ),
-                    torch.tensor(1.0, device=device),
-                ).to(lengths_dtype)
-            else:
-                lengths_ = torch.abs(
-                    torch.randn(batch_size * world_size, device=device) + pooling_avg,
-                ).to(lengths_dtype)
-
-            if idlist_max_lengths[idx]:
-                lengths_ = torch.clamp(lengths_, max=idlist_max_lengths[idx])
-
-            if variable_batch_size:
-                lengths = torch.zeros(batch_size * world_size, device=device).to(
-                    lengths_dtype
-                )
-                for r in range(world_size):
-                    lengths[r * batch_size : r * batch_size + batch_size_by_rank[r]] = (
-                        lengths_[
-                            r * batch_size : r * batch_size + batch_size_by_rank[r]
-                        ]
-                    )
-            else:
-                lengths = lengths_
-
-            num_indices = cast(int, torch.sum(lengths).item())
-
-            if randomize_indices:
-                indices = torch.randint(
-                    0,
-                    ind_range,
-                    (num_indices,),
-                    dtype=indices_dtype,
-                    device=device,
+                pooling_factor = torch.tensor(
+                    idlist_pooling_factor, dtype=torch.float
+                ).unsqueeze(1)
+                lengths_ = (
+                    torch.randn(len(idlist_ind_ranges), global_batch_size)
+                    .mul_(pooling_factor / 10)
+                    .add_(pooling_factor)
+                    .clamp_min_(1.0)
+                    .to(lengths_dtype)
                 )
             else:
-                indices = torch.zeros(
-                    (num_indices,),
-                    dtype=indices_dtype,
-                    device=device,
+                lengths_ = (
+                    torch.randn(len(idlist_ind_ranges), global_batch_size)
+                    .add_(pooling_avg)
+                    .abs_()
+                    .to(lengths_dtype)
                 )
 
+            if any(idlist_max_lengths):
+                max_lengths = torch.tensor(
+                    [
+                        max_length if max_length else torch.iinfo(lengths_dtype).max
+                        for max_length in idlist_max_lengths
+                    ],
+                    dtype=lengths_dtype,
+                ).unsqueeze(1)
+                lengths_ = torch.minimum(lengths_, max_lengths)
+
+            lengths = _mask_variable_batch(lengths_)
+            indices, num_indices_per_feature = _generate_indices(
+                lengths, idlist_ind_ranges
+            )
+            global_idlist_rank_offsets = _rank_offsets(lengths)
+            lengths = lengths.to(device)
             # Calculate offsets from lengths
-            offsets = torch.cat(
-                [torch.tensor([0], device=device), lengths.cumsum(0)]
-            ).to(offsets_dtype)
-
-            global_idlist_lengths.append(lengths)
-            global_idlist_indices.append(indices)
-            global_idlist_offsets.append(offsets)
-
-        for idx, ind_range in enumerate(idscore_ind_ranges):
-            lengths_ = torch.abs(
-                torch.randn(batch_size * world_size, device=device)
-                + (
-                    idscore_pooling_factor[idx]
-                    if idscore_pooling_factor
-                    else pooling_avg
-                )
-            ).to(lengths_dtype)
+            offsets = torch.nn.functional.pad(lengths.cumsum(1), (1, 0)).to(
+                offsets_dtype
+            )
 
-            if variable_batch_size:
-                lengths = torch.zeros(batch_size * world_size, device=device).to(
-                    lengths_dtype
-                )
-                for r in range(world_size):
-                    lengths[r * batch_size : r * batch_size + batch_size_by_rank[r]] = (
-                        lengths_[
-                            r * batch_size : r * batch_size + batch_size_by_rank[r]
-                        ]
-                    )
-            else:
-                lengths = lengths_
+            idlist_values, idlist_lengths, idlist_offsets = indices, lengths, offsets
+            global_idlist_lengths = list(lengths.unbind(0))
+            global_idlist_indices = list(indices.split(num_indices_per_feature))
+            global_idlist_offsets = list(offsets.unbind(0))
 
-            num_indices = cast(int, torch.sum(lengths).item())
+        if has_idscore:
+            pooling_factor = torch.tensor(
+                (
+                    idscore_pooling_factor
+                    if idscore_pooling_factor
+                    else [pooling_avg] * len(idscore_ind_ranges)
+                ),
+                dtype=torch.float,
+            ).unsqueeze(1)
+            lengths_ = (
+                torch.randn(len(idscore_ind_ranges), global_batch_size)
+                .add_(pooling_factor)
+                .abs_()
+                .to(lengths_dtype)
+            )
 
-            if randomize_indices:
-                indices = torch.randint(
-                    0,
-                    # pyre-ignore [6]
-                    ind_range,
-                    (num_indices,),
-                    dtype=indices_dtype,
-                    device=device,
-                )
-            else:
-                indices = torch.zeros(
-                    (num_indices,),
-                    dtype=indices_dtype,
-                    device=device,
-                )
-            weights = torch.rand((num_indices,), device=device)
+            lengths = _mask_variable_batch(lengths_)
+            indices, num_indices_per_feature = _generate_indices(
+                lengths,
+                idscore_ind_ranges,  # pyre-ignore [6]
+            )
+            global_idscore_rank_offsets = _rank_offsets(lengths)
+            lengths = lengths.to(device)
+            weights = torch.rand((indices.numel(),), device=device)
             # Calculate offsets from lengths
-            offsets = torch.cat(
-                [torch.tensor([0], device=device), lengths.cumsum(0)]
-            ).to(offsets_dtype)
+            offsets = torch.nn.functional.pad(lengths.cumsum(1), (1, 0)).to(
+                offsets_dtype
+            )
 
-            global_idscore_lengths.append(lengths)
-            global_idscore_indices.append(indices)
-            global_idscore_weights.append(weights)
-            global_idscore_offsets.append(offsets)
+            idscore_values, idscore_lengths = indices, lengths
+            idscore_offsets, idscore_weights = offsets, weights
+            global_idscore_lengths = list(lengths.unbind(0))
+            global_idscore_indices = list(indices.split(num_indices_per_feature))
+            global_idscore_weights = list(weights.split(num_indices_per_feature))
+            global_idscore_offsets = list(offsets.unbind(0))
 
         if input_type == "kjt":
-            global_idlist_input = KeyedJaggedTensor(
-                keys=idlist_features,
-                values=torch.cat(global_idlist_indices),
-                offsets=torch.cat(global_idlist_offsets) if use_offsets else None,
-                lengths=torch.cat(global_idlist_lengths) if not use_offsets else None,
+            assert (
+                idlist_values is not None
+                and idlist_lengths is not None
+                and idlist_offsets is not None
+            ), "At least one unweighted table is required"
+            global_idlist_input = _build_kjt(
+                idlist_features,
+                [idlist_values],
+                [idlist_lengths.view(-1)],
+                [idlist_offsets.view(-1)],
             )
 
             global_idscore_input = (
-                KeyedJaggedTensor(
-                    keys=idscore_features,
-                    values=torch.cat(global_idscore_indices),
-                    offsets=torch.cat(global_idscore_offsets) if use_offsets else None,
-                    lengths=(
-                        torch.cat(global_idscore_lengths) if not use_offsets else None
-                    ),
-                    weights=torch.cat(global_idscore_weights),
+                _build_kjt(
+                    idscore_features,
+                    [idscore_values],
+                    [idscore_lengths.view(-1)],
+                    [idscore_offsets.view(-1)],
+                    [idscore_weights],
                 )
-                if global_idscore_indices
+                if idscore_values is not None
+                and idscore_lengths is not None
+                and idscore_offsets is not None
+                and idscore_weights is not None
                 else None
             )
         elif input_type == "td":
+            assert idlist_lengths is not None
+            # Offsets of all features come from one batched cumsum; passing them
+            # skips the per-feature lengths -> offsets conversion.
+            nt_offsets = torch.nn.functional.pad(idlist_lengths.cumsum(1), (1, 0))
             dict_of_nt = {
                 k: torch.nested.nested_tensor_from_jagged(
                     values=values,
-                    lengths=lengths,
+                    offsets=offsets,
                 )
-                for k, values, lengths in zip(
-                    idlist_features, global_idlist_indices, global_idlist_lengths
+                for k, values, offsets in zip(
+                    idlist_features, global_idlist_indices, nt_offsets.unbind(0)
                 )
             }
             global_idlist_input = TensorDict(source=dict_of_nt)
@@ -332,14 +445,14 @@ class ModelInput(Pipelineable):
 
         if randomize_indices:
             global_float = torch.rand(
-                (batch_size * world_size, num_float_features), device=device
+                (global_batch_size, num_float_features), device=device
             )
-            global_label = torch.rand(batch_size * world_size, device=device)
+            global_label = torch.rand(global_batch_size, device=device)
         else:
             global_float = torch.zeros(
-                (batch_size * world_size, num_float_features), device=device
+                (global_batch_size, num_float_features), device=device
             )
-            global_label = torch.zeros(batch_size * world_size, device=device)
+            global_label = torch.zeros(global_batch_size, device=device)
 
         # Split global batch into local batches.
         local_inputs = []
@@ -354,15 +467,15 @@ class ModelInput(Pipelineable):
             local_idscore_weights = []
             local_idscore_offsets = []
 
-            for lengths, indices, offsets in zip(
-                global_idlist_lengths, global_idlist_indices, global_idlist_offsets
+            for lengths, indices, offsets, lengths_cumsum in zip(
+                global_idlist_lengths,
+                global_idlist_indices,
+                global_idlist_offsets,
+                global_idlist_rank_offsets,
             ):
                 local_idlist_lengths.append(
                     lengths[r * batch_size : r * batch_size + batch_size_by_rank[r]]
                 )
-                lengths_cumsum = [0] + lengths.view(world_size, -1).sum(dim=1).cumsum(
-                    dim=0
-                ).tolist()
                 local_idlist_indices.append(
                     indices[lengths_cumsum[r] : lengths_cumsum[r + 1]]
                 )
@@ -370,66 +483,66 @@ class ModelInput(Pipelineable):
                     offsets[r * batch_size : r * batch_size + batch_size_by_rank[r] + 1]
                 )
 
-            for lengths, indices, weights, offsets in zip(
-                global_idscore_lengths,
-                global_idscore_indices,
-                global_idscore_weights,
-                global_idscore_offsets,
-            ):
-                local_idscore_lengths.append(
-                    lengths[r * batch_size : r * batch_size + batch_size_by_rank[r]]
-                )
-                lengths_cumsum = [0] + lengths.view(world_size, -1).sum(dim=1).cumsum(
-                    dim=0
-                ).tolist()
-                local_idscore_indices.append(
-                    indices[lengths_cumsum[r] : lengths_cumsum[r + 1]]
-                )
-                local_idscore_weights.append(
-                    weights[lengths_cumsum[r] : lengths_cumsum[r + 1]]
-                )
+            if has_idscore:
+                for lengths, indices, weights, offsets, lengths_cumsum in zip(
+                    global_idscore_lengths,
+                    global_idscore_indices,
+                    global_idscore_weights,
+                    global_idscore_offsets,
+                    global_idscore_rank_offsets,
+                ):
+                    local_idscore_lengths.append(
+                        lengths[r * batch_size : r * batch_size + batch_size_by_rank[r]]
+                    )
+                    local_idscore_indices.append(
+                        indices[lengths_cumsum[r] : lengths_cumsum[r + 1]]
+                    )
+                    local_idscore_weights.append(
+                        weights[lengths_cumsum[r] : lengths_cumsum[r + 1]]
+                    )
 
-                local_idscore_offsets.append(
-                    offsets[r * batch_size : r * batch_size + batch_size_by_rank[r] + 1]
-                )
+                    local_idscore_offsets.append(
+                        offsets[
+                            r * batch_size : r * batch_size + batch_size_by_rank[r] + 1
+                        ]
+                    )
 
             if input_type == "kjt":
-                local_idlist_input = KeyedJaggedTensor(
-                    keys=idlist_features,
-                    values=torch.cat(local_idlist_indices),
-                    offsets=torch.cat(local_idlist_offsets) if use_offsets else None,
-                    lengths=(
-                        torch.cat(local_idlist_lengths) if not use_offsets else None
-                    ),
+                local_idlist_input = _build_kjt(
+                    idlist_features,
+                    local_idlist_indices,
+                    local_idlist_lengths,
+                    local_idlist_offsets,
                 )
 
                 local_idscore_input = (
-                    KeyedJaggedTensor(
-                        keys=idscore_features,
-                        values=torch.cat(local_idscore_indices),
-                        offsets=(
-                            torch.cat(local_idscore_offsets) if use_offsets else None
-                        ),
-                        lengths=(
-                            torch.cat(local_idscore_lengths)
-                            if not use_offsets
-                            else None
-                        ),
-                        weights=torch.cat(local_idscore_weights),
+                    _build_kjt(
+                        idscore_features,
+                        local_idscore_indices,
+                        local_idscore_lengths,
+                        local_idscore_offsets,
+                        local_idscore_weights,
                     )
-                    if local_idscore_indices
+                    if has_idscore
                     else None
                 )
             elif input_type == "td":
+                assert idlist_lengths is not None
+                nt_offsets = torch.nn.functional.pad(
+                    idlist_lengths[
+                        :, r * batch_size : r * batch_size + batch_size_by_rank[r]
+                    ].cumsum(1),
+                    (1, 0),
+                )
                 dict_of_nt = {
                     k: torch.nested.nested_tensor_from_jagged(
                         values=values,
-                        lengths=lengths,
+                        offsets=offsets,
                     )
-                    for k, values, lengths in zip(
+                    for k, values, offsets in zip(
                         idlist_features,
                         local_idlist_indices,
-                        local_idlist_lengths,
+                        nt_offsets.unbind(0),
                     )
                 }
                 local_idlist_input = TensorDict(source=dict_of_nt)
@@ -475,9 +588,11 @@ class ModelInput(Pipelineable):
         indices_dtype: torch.dtype,
         offsets_dtype: torch.dtype,
         lengths_dtype: torch.dtype,
+        generator: torch.Generator,
     ) -> List[KeyedJaggedTensor]:
         local_kjts = []
         keys = list(feature_num_embeddings.keys())
+        num_embeddings_per_key = list(feature_num_embeddings.values())
 
         for rank in range(world_size):
             lengths_per_rank_per_feature[rank] = {}
@@ -488,44 +603,72 @@ class ModelInput(Pipelineable):
             if weights_per_rank_per_feature is not None:
                 weights_per_rank_per_feature[rank] = {}
 
-            for key, num_embeddings in feature_num_embeddings.items():
-                batch_size = random.randint(1, average_batch_size * dedup_factor - 1)
-                lengths = torch.randint(
-                    low=0, high=5, size=(batch_size,), dtype=lengths_dtype
-                )
-                lengths_per_rank_per_feature[rank][key] = lengths
-                lengths_sum = sum(lengths.tolist())
-                values = torch.randint(
-                    0, num_embeddings, (lengths_sum,), dtype=indices_dtype
-                )
-                values_per_rank_per_feature[rank][key] = values
-                if weights_per_rank_per_feature is not None:
-                    weights_per_rank_per_feature[rank][key] = torch.rand(lengths_sum)
-                strides_per_rank_per_feature[rank][key] = batch_size
-                inverse_indices_per_rank_per_feature[rank][key] = torch.randint(
-                    0,
-                    batch_size,
-                    (dedup_factor * average_batch_size,),
-                    dtype=indices_dtype,
+            batch_sizes = torch.randint(
+                1,
+                average_batch_size * dedup_factor,
+                (len(keys),),
+                generator=generator,
+            ).tolist()
+            # Draw the lengths, values and weights of all features at once.
+            lengths = torch.randint(
+                low=0,
+                high=5,
+                size=(sum(batch_sizes),),
+                dtype=lengths_dtype,
+                generator=generator,
+            )
+            lengths_per_key = lengths.split(batch_sizes)
+            offsets = _to_offsets(lengths)
+            # Every feature's value count comes from the rank's offsets.
+            num_values_per_key = (
+                offsets[
+                    torch.tensor(list(itertools.accumulate(batch_sizes, initial=0)))
+                ]
+                .diff()
+                .tolist()
+            )
+            num_values = sum(num_values_per_key)
+            # Uniform samples scaled by each feature's own range keep every
+            # feature's values uniform.
+            values = (
+                torch.rand(num_values, dtype=torch.double, generator=generator)
+                * torch.repeat_interleave(
+                    torch.tensor(num_embeddings_per_key, dtype=torch.double),
+                    torch.tensor(num_values_per_key),
+                    output_size=num_values,
                 )
-
-            values = torch.cat(list(values_per_rank_per_feature[rank].values()))
-            lengths = torch.cat(list(lengths_per_rank_per_feature[rank].values()))
+            ).to(indices_dtype)
+            values_per_key = values.split(num_values_per_key)
             weights = (
-                torch.cat(list(weights_per_rank_per_feature[rank].values()))
+                torch.rand(num_values, generator=generator)
                 if weights_per_rank_per_feature is not None
                 else None
             )
+            weights_per_key = (
+                weights.split(num_values_per_key) if weights is not None else None
+            )
+            # Inverse indices share one shape across keys, so their rows are
+            # filled in place rather than stacked afterwards.
+            inverse_indices_mat = torch.empty(
+                (len(keys), dedup_factor * average_batch_size), dtype=indices_dtype
+            )
+
+            for i, (key, batch_size) in enumerate(zip(keys, batch_sizes)):
+                lengths_per_rank_per_feature[rank][key] = lengths_per_key[i]
+                values_per_rank_per_feature[rank][key] = values_per_key[i]
+                if weights_per_rank_per_feature is not None:
+                    assert weights_per_key is not None
+                    weights_per_rank_per_feature[rank][key] = weights_per_key[i]
+                strides_per_rank_per_feature[rank][key] = batch_size
+                inverse_indices_mat[i].random_(0, batch_size, generator=generator)
+                inverse_indices_per_rank_per_feature[rank][key] = inverse_indices_mat[i]
 
             if use_offsets:
-                offsets = torch.cat(
-                    [torch.tensor([0], dtype=offsets_dtype), lengths.cumsum(0)]
-                )
                 local_kjts.append(
                     KeyedJaggedTensor(
                         keys=keys,
                         values=values,
-                        offsets=offsets,
+                        offsets=offsets.to(offsets_dtype),
                         weights=weights,
                     )
                 )
@@ -533,12 +676,7 @@ class ModelInput(Pipelineable):
                 stride_per_key_per_rank = [
                     [stride] for stride in strides_per_rank_per_feature[rank].values()
                 ]
-                inverse_indices = (
-                    keys,
-                    torch.stack(
-                        list(inverse_indices_per_rank_per_feature[rank].values())
-                    ),
-                )
+                inverse_indices = (keys, inverse_indices_mat)
                 local_kjts.append(
                     KeyedJaggedTensor(
                         keys=keys,
@@ -618,21 +756,27 @@ class ModelInput(Pipelineable):
                 reindexed_lengths.append(torch.index_select(length, 0, indices))
 
             lengths = torch.cat(reindexed_lengths)
-            reindexed_values, reindexed_weights = [], []
-
-            for i, (values, offsets, indices) in enumerate(
-                zip(global_values, global_offsets, inverse_indices_per_feature_per_rank)
-            ):
-                for idx in indices:
-                    reindexed_values.append(values[offsets[idx] : offsets[idx + 1]])
-                    if global_weights is not None:
-                        reindexed_weights.append(
-                            global_weights[i][offsets[idx] : offsets[idx + 1]]
-                        )
-
-            values = torch.cat(reindexed_values)
+            gather_indices = [
+                _jagged_gather_index(offsets, indices)
+                for offsets, indices in zip(
+                    global_offsets, inverse_indices_per_feature_per_rank
+                )
+            ]
+            values = torch.cat(
+                [
+                    torch.index_select(values, 0, gather_index)
+                    for values, gather_index in zip(global_values, gather_indices)
+                ]
+            )
             weights = (
-                torch.cat(reindexed_weights) if global_weights is not None else None
+                torch.cat(
+                    [
+                        torch.index_select(weights, 0, gather_index)
+                        for weights, gather_index in zip(global_weights, gather_indices)
+                    ]
+                )
+                if global_weights is not None
+                else None
             )
             global_stride_per_key_per_rank = None
             global_inverse_indices = None
@@ -643,13 +787,10 @@ class ModelInput(Pipelineable):
             weights = torch.cat(global_weights) if global_weights is not None else None
 
         if use_offsets:
-            offsets = torch.cat(
-                [torch.tensor([0], dtype=offsets_dtype), lengths.cumsum(0)]
-            )
             return KeyedJaggedTensor(
                 keys=keys,
                 values=values,
-                offsets=offsets,
+                offsets=_to_offsets(lengths).to(offsets_dtype),
                 weights=weights,
                 stride_per_key_per_rank=global_stride_per_key_per_rank,
                 inverse_indices=global_inverse_indices,
@@ -677,6 +818,7 @@ class ModelInput(Pipelineable):
         indices_dtype: torch.dtype,
         offsets_dtype: torch.dtype,
         lengths_dtype: torch.dtype,
+        generator: torch.Generator,
     ) -> Tuple[KeyedJaggedTensor, List[KeyedJaggedTensor]]:
         is_weighted = (
             True if tables and getattr(tables[0], "is_weighted", False) else False
@@ -714,6 +856,7 @@ class ModelInput(Pipelineable):
             indices_dtype=indices_dtype,
             offsets_dtype=offsets_dtype,
             lengths_dtype=lengths_dtype,
+            generator=generator,
         )
 
         global_kjt = ModelInput._generate_variable_batch_global_features(
@@ -756,12 +899,14 @@ class ModelInput(Pipelineable):
         lengths_dtype: torch.dtype = torch.int64,
         random_seed: Optional[int] = None,
     ) -> Tuple["ModelInput", List["ModelInput"]]:
-        if random_seed is not None:
-            torch.manual_seed(random_seed)
-            random.seed(random_seed)
-        else:
-            torch.manual_seed(100)
-            random.seed(100)
+        if random_seed is None:
+            random_seed = 100
+        torch.manual_seed(random_seed)
+        random.seed(random_seed)
+        # Sparse features draw from their own generator, so they do not contend
+        # on (or depend on other users of) the global default generator.
+        generator = torch.Generator()
+        generator.manual_seed(random_seed)
         dedup_factor = 2
 
         global_kjt, local_kjts = ModelInput._generate_variable_batch_features(
@@ -774,6 +919,7 @@ class ModelInput(Pipelineable):
             indices_dtype=indices_dtype,
             offsets_dtype=offsets_dtype,
             lengths_dtype=lengths_dtype,
+            generator=generator,
         )
 
         if weighted_tables:
@@ -788,6 +934,7 @@ class ModelInput(Pipelineable):
                     indices_dtype=indices_dtype,
                     offsets_dtype=offsets_dtype,
                     lengths_dtype=lengths_dtype,
+                    generator=generator,
                 )
             )
         else:
@@ -797,18 +944,13 @@ class ModelInput(Pipelineable):
             (dedup_factor * average_batch_size * world_size, num_float_features)
         )
 
-        local_model_input = []
-        label_per_rank = []
+        # Labels for all ranks come from one draw; per-rank inputs are views.
+        global_label = torch.rand(world_size, dedup_factor * average_batch_size)
+        label_per_rank = global_label.unbind(0)
+        float_per_rank = global_float.chunk(world_size, dim=0)
 
+        local_model_input = []
         for rank in range(world_size):
-            label_per_rank.append(torch.rand(dedup_factor * average_batch_size))
-            local_float = global_float[
-                rank
-                * dedup_factor
-                * average_batch_size : (rank + 1)
-                * dedup_factor
-                * average_batch_size
-            ]
             local_model_input.append(
                 ModelInput(
                     idlist_features=local_kjts[rank],
@@ -816,14 +958,14 @@ class ModelInput(Pipelineable):
                         local_score_kjts[rank] if local_score_kjts else None
                     ),
                     label=label_per_rank[rank],
-                    float_features=local_float,
+                    float_features=float_per_rank[rank],
                 ),
             )
 
         global_model_input = ModelInput(
             idlist_features=global_kjt,
             idscore_features=global_score_kjt,
-            label=torch.cat(label_per_rank),
+            label=global_label.view(-1),
             float_features=global_float,
         )
 
@@ -946,6 +1088,47 @@ def _concat(
     return torch.cat([dense] + sparse_embeddings, dim=1)
 
 
+def _split_linear(
+    linear: nn.Linear, dense: torch.Tensor, sparse: torch.Tensor
+) -> torch.Tensor:
+    """
+    Returns `linear(torch.cat([dense, sparse], dim=1))` without materializing the
+    concatenation, by multiplying each input with its column slice of the weight.
+    """
+    weight = linear.weight
+    num_dense = dense.size(1)
+    out = torch.addmm(linear.bias, dense, weight[:, :num_dense].t())
+    return out.addmm_(sparse, weight[:, num_dense:].t())
+
+
+def _tables_key(
+    tables: List[EmbeddingBagConfig],
+) -> Tuple[Tuple[int, Tuple[str, ...]], ...]:
+    return tuple((table.embedding_dim, tuple(table.feature_names)) for table in tables)
+
+
+@functools.lru_cache(maxsize=None)
+def _over_arch_dims(
+    tables: Tuple[Tuple[int, Tuple[str, ...]], ...],
+    weighted_tables: Tuple[Tuple[int, Tuple[str, ...]], ...],
+) -> Tuple[Tuple[str, ...], Tuple[str, ...], int]:
+    """
+    Returns the unweighted and weighted feature names and the input width of
+    the over arch (8 dense outputs plus every pooled embedding) for the given
+    (embedding_dim, feature_names) table keys.
+    """
+    in_features = 8
+    for embedding_dim, feature_names in tables + weighted_tables:
+        in_features += embedding_dim * len(feature_names)
+    return (
+        tuple(feature for _, feature_names in tables for feature in feature_names),
+        tuple(
+            feature for _, feature_names in weighted_tables for feature in feature_names
+        ),
+        in_features,
+    )
+
+
 class TestOverArchRegroupModule(nn.Module):
     """
     Basic nn.Module for testing
@@ -975,24 +1158,13 @@ class TestOverArchRegroupModule(nn.Module):
         super().__init__()
         if device is None:
             device = torch.device("cpu")
-        self._embedding_names: List[str] = (
-            embedding_names
-            if embedding_names
-            else [feature for table in tables for feature in table.feature_names]
+        feature_names, weighted_features, in_features = _over_arch_dims(
+            _tables_key(tables), _tables_key(weighted_tables)
         )
-        self._weighted_features: List[str] = [
-            feature for table in weighted_tables for feature in table.feature_names
-        ]
-        in_features = (
-            8
-            + sum([table.embedding_dim * len(table.feature_names) for table in tables])
-            + sum(
-                [
-                    table.embedding_dim * len(table.feature_names)
-                    for table in weighted_tables
-                ]
-            )
+        self._embedding_names: List[str] = (
+            embedding_names if embedding_names else list(feature_names)
         )
+        self._weighted_features: List[str] = list(weighted_features)
         self.dhn_arch: nn.Module = TestDHNArch(in_features, device)
         self.regroup_module = KTRegroupAsDict(
             [self._embedding_names, self._weighted_features],
@@ -1038,24 +1210,13 @@ class TestOverArch(nn.Module):
         super().__init__()
         if device is None:
             device = torch.device("cpu")
-        self._embedding_names: List[str] = (
-            embedding_names
-            if embedding_names
-            else [feature for table in tables for feature in table.feature_names]
+        feature_names, weighted_features, in_features = _over_arch_dims(
+            _tables_key(tables), _tables_key(weighted_tables)
         )
-        self._weighted_features: List[str] = [
-            feature for table in weighted_tables for feature in table.feature_names
-        ]
-        in_features = (
-            8
-            + sum([table.embedding_dim * len(table.feature_names) for table in tables])
-            + sum(
-                [
-                    table.embedding_dim * len(table.feature_names)
-                    for table in weighted_tables
-                ]
-            )
+        self._embedding_names: List[str] = (
+            embedding_names if embedding_names else list(feature_names)
         )
+        self._weighted_features: List[str] = list(weighted_features)
         self.dhn_arch: nn.Module = TestDHNArch(in_features, device)
 
     def forward(
@@ -1085,24 +1246,13 @@ class TestOverArchLarge(nn.Module):
         super().__init__()
         if device is None:
             device = torch.device("cpu")
-        self._embedding_names: List[str] = (
-            embedding_names
-            if embedding_names
-            else [feature for table in tables for feature in table.feature_names]
+        feature_names, weighted_features, in_features = _over_arch_dims(
+            _tables_key(tables), _tables_key(weighted_tables)
         )
-        self._weighted_features: List[str] = [
-            feature for table in weighted_tables for feature in table.feature_names
-        ]
-        in_features = (
-            8
-            + sum([table.embedding_dim * len(table.feature_names) for table in tables])
-            + sum(
-                [
-                    table.embedding_dim * len(table.feature_names)
-                    for table in weighted_tables
-                ]
-            )
+        self._embedding_names: List[str] = (
+            embedding_names if embedding_names else list(feature_names)
         )
+        self._weighted_features: List[str] = list(weighted_features)
         out_features = 1000
         layers = [
             torch.nn.Linear(
@@ -1137,6 +1287,12 @@ class TestOverArchLarge(nn.Module):
         return self.overarch(torch.cat(ret_list, dim=1))
 
 
+def _pad_rows(values: torch.Tensor, num_rows: int) -> torch.Tensor:
+    if values.size(0) == num_rows:
+        return values
+    return torch.nn.functional.pad(values, [0, 0, 0, num_rows - values.size(0)])
+
+
 @torch.fx.wrap
 def _post_sparsenn_forward(
     ebc: KeyedTensor,
@@ -1144,78 +1300,51 @@ def _post_sparsenn_forward(
     w_ebc: Optional[KeyedTensor],
     batch_size: Optional[int] = None,
 ) -> KeyedTensor:
-    if batch_size is None or ebc.values().size(0) == batch_size:
-        ebc_values = ebc.values()
-        fp_ebc_values = fp_ebc.values() if fp_ebc is not None else None
-        w_ebc_values = w_ebc.values() if w_ebc is not None else None
-    else:
-        ebc_values = torch.zeros(
-            batch_size,
-            ebc.values().size(1),
-            dtype=ebc.values().dtype,
-            device=ebc.values().device,
-        )
-        ebc_values[: ebc.values().size(0), :] = ebc.values()
-        if fp_ebc is not None:
-            fp_ebc_values = torch.zeros(
-                batch_size,
-                fp_ebc.values().size(1),
-                dtype=fp_ebc.values().dtype,
-                device=fp_ebc.values().device,
-            )
-            fp_ebc_values[: fp_ebc.values().size(0), :] = fp_ebc.values()
-        else:
-            fp_ebc_values = None
-        if w_ebc is not None:
-            w_ebc_values = torch.zeros(
-                batch_size,
-                w_ebc.values().size(1),
-                dtype=w_ebc.values().dtype,
-                device=w_ebc.values().device,
-            )
-            w_ebc_values[: w_ebc.values().size(0), :] = w_ebc.values()
-        else:
-            w_ebc_values = None
-
+    ebc_values = ebc.values()
+    num_rows = ebc_values.size(0) if batch_size is None else batch_size
     if fp_ebc is None and w_ebc is None:
         return KeyedTensor(
             keys=ebc.keys(),
             length_per_key=ebc.length_per_key(),
-            values=ebc_values,
-        )
-    elif fp_ebc is None and w_ebc is not None:
+            values=_pad_rows(ebc_values, num_rows),
+        )
+
+    keys: List[str] = ebc.keys()
+    length_per_key: List[int] = ebc.length_per_key()
+    values_list: List[torch.Tensor] = [ebc_values]
+    if fp_ebc is not None:
+        keys = keys + fp_ebc.keys()
+        length_per_key = length_per_key + fp_ebc.length_per_key()
+        values_list.append(fp_ebc.values())
+    if w_ebc is not None:
+        keys = keys + w_ebc.keys()
+        length_per_key = length_per_key + w_ebc.length_per_key()
+        values_list.append(w_ebc.values())
+
+    if all(values.size(0) == num_rows for values in values_list):
         return KeyedTensor(
-            keys=ebc.keys() + w_ebc.keys(),
-            length_per_key=ebc.length_per_key() + w_ebc.length_per_key(),
-            values=torch.cat(
-                [ebc_values, torch.jit._unwrap_optional(w_ebc_values)], dim=1
-            ),
-        )
-    elif fp_ebc is not None and w_ebc is None:
-        return KeyedTensor(
-            keys=ebc.keys() + fp_ebc.keys(),
-            length_per_key=ebc.length_per_key() + fp_ebc.length_per_key(),
-            values=torch.cat(
-                [ebc_values, torch.jit._unwrap_optional(fp_ebc_values)], dim=1
-            ),
-        )
-    else:
-        assert fp_ebc is not None and w_ebc is not None
-        return KeyedTensor(
-            keys=ebc.keys() + fp_ebc.keys() + w_ebc.keys(),
-            length_per_key=ebc.length_per_key()
-            + fp_ebc.length_per_key()
-            + w_ebc.length_per_key(),
-            # Comment to torch.jit._unwrap_optional fp_ebc_values is inferred as Optional[Tensor] as it can be None when fp_ebc is None. But at this point we now that it has a value and doing jit._unwrap_optional will tell jit to treat it as Tensor type.
-            values=torch.cat(
-                [
-                    ebc_values,
-                    torch.jit._unwrap_optional(fp_ebc_values),
-                    torch.jit._unwrap_optional(w_ebc_values),
-                ],
-                dim=1,
-            ),
-        )
+            keys=keys,
+            length_per_key=length_per_key,
+            values=torch.cat(values_list, dim=1),
+        )
+
+    # Copy every KT into its column block of a single output, zeroing only the
+    # padded rows, instead of zero-filling per KT and concatenating afterwards.
+    out = torch.empty(
+        (num_rows, sum(length_per_key)),
+        dtype=ebc_values.dtype,
+        device=ebc_values.device,
+    )
+    col = 0
+    for values in values_list:
+        rows = values.size(0)
+        cols = values.size(1)
+        out[:rows, col : col + cols].copy_(values)
+        if rows < num_rows:
+            out[rows:, col : col + cols].zero_()
+        col += cols
+
+    return KeyedTensor(keys=keys, length_per_key=length_per_key, values=out)
 
 
 class TestECSparseArch(nn.Module):
@@ -1475,7 +1604,8 @@ class TestSparseNN(TestSparseNNBase, CopyableMixin):
     ) -> Union[torch.Tensor, Tuple[torch.Tensor, torch.Tensor]]:
         dense_r = self.dense(input.float_features)
         over_r = self.over(dense_r, sparse_output)
-        pred = torch.sigmoid(torch.mean(over_r, dim=1)) + self.dummy_ones
+        # sigmoid_ is safe: mean's output is not saved for backward
+        pred = torch.mean(over_r, dim=1).sigmoid_() + self.dummy_ones
         if self.training:
             return (
                 torch.nn.functional.binary_cross_entropy_with_logits(pred, input.label),
@@ -1718,7 +1848,7 @@ class TestTowerCollectionSparseNN(TestSparseNNBase):
     ) -> Union[torch.Tensor, Tuple[torch.Tensor, torch.Tensor]]:
         dense_r = self.dense(input.float_features)
         sparse_r = self.tower_arch(input.idlist_features, input.idscore_features)
-        over_r = self.over(torch.cat([dense_r, sparse_r], dim=1))
+        over_r = _split_linear(self.over, dense_r, sparse_r)
         pred = torch.sigmoid(torch.mean(over_r, dim=1))
         if self.training:
             return (
@@ -1983,6 +2113,13 @@ class TestETCSharder(EmbeddingTowerCollectionSharder):
         return self._fused_params
 
 
+_DTYPE_PRECISIONS: Dict[torch.dtype, Tuple[float, float]] = {
+    torch.float16: (1e-3, 1e-3),
+    torch.float32: (1e-4, 1e-5),
+    torch.float64: (1e-5, 1e-8),
+}
+
+
 def _get_default_rtol_and_atol(
     actual: torch.Tensor, expected: torch.Tensor
 ) -> Tuple[float, float]:
@@ -1990,16 +2127,18 @@ def _get_default_rtol_and_atol(
     default tolerance values for torch.testing.assert_close,
     consistent with the values of torch.testing.assert_close
     """
-    _DTYPE_PRECISIONS = {
-        torch.float16: (1e-3, 1e-3),
-        torch.float32: (1e-4, 1e-5),
-        torch.float64: (1e-5, 1e-8),
-    }
+    if actual.dtype == expected.dtype:
+        return _DTYPE_PRECISIONS.get(actual.dtype, (0.0, 0.0))
     actual_rtol, actual_atol = _DTYPE_PRECISIONS.get(actual.dtype, (0.0, 0.0))
     expected_rtol, expected_atol = _DTYPE_PRECISIONS.get(expected.dtype, (0.0, 0.0))
     return max(actual_rtol, expected_rtol), max(actual_atol, expected_atol)
 
 
+def _last_key_index(keys: List[str], key: str) -> int:
+    # matches kjt[key], which resolves a duplicated key to its last occurrence
+    return len(keys) - 1 - keys[::-1].index(key)
+
+
 class TestPreprocNonWeighted(nn.Module):
     """
     Basic module for testing
@@ -2015,21 +2154,18 @@ class TestPreprocNonWeighted(nn.Module):
         """
         Selects 3 features from a specific KJT
         """
-        # split
-        jt_0 = kjt["feature_0"]
-        jt_1 = kjt["feature_1"]
-        jt_2 = kjt["feature_2"]
-
-        # merge only features 0,1,2, removing feature 3
-        return [
-            KeyedJaggedTensor.from_jt_dict(
-                {
-                    "feature_0": jt_0,
-                    "feature_1": jt_1,
-                    "feature_2": jt_2,
-                }
-            )
+        # keep only features 0,1,2, removing feature 3, with a single permute
+        # rather than splitting into JaggedTensors and merging them back
+        keys = kjt.keys()
+        indices = [
+            _last_key_index(keys, key)
+            for key in ["feature_0", "feature_1", "feature_2"]
         ]
+        if indices == [0, 1, 2]:
+            # kept features are a leading block: split returns views of the
+            # values/lengths instead of gathering them with a permute kernel
+            return [kjt.split([3, len(keys) - 3])[0]]
+        return [kjt.permute(indices)]
 
 
 class TestPreprocWeighted(nn.Module):
@@ -2048,17 +2184,8 @@ class TestPreprocWeighted(nn.Module):
         Selects 1 feature from specific weighted KJT
         """
 
-        # split
-        jt_0 = kjt["weighted_feature_0"]
-
         # keep only weighted_feature_0
-        return [
-            KeyedJaggedTensor.from_jt_dict(
-                {
-                    "weighted_feature_0": jt_0,
-                }
-            )
-        ]
+        return [kjt.permute([_last_key_index(kjt.keys(), "weighted_feature_0")])]
 
 
 class TestModelWithPreproc(nn.Module):
@@ -2142,8 +2269,11 @@ class TestModelWithPreproc(nn.Module):
         ebc_out = self.ebc(modified_idlist_features[0])
         weighted_ebc_out = self.weighted_ebc(modified_idscore_features[0])
 
-        pred = torch.cat([ebc_out.values(), weighted_ebc_out.values()], dim=1)
-        return pred.sum(), pred
+        ebc_values = ebc_out.values()
+        weighted_ebc_values = weighted_ebc_out.values()
+        loss = ebc_values.sum() + weighted_ebc_values.sum()
+        pred = torch.cat([ebc_values, weighted_ebc_values], dim=1)
+        return loss, pred
 
 
 class TestModelWithPreprocCollectionArgs(nn.Module):
@@ -2239,8 +2369,11 @@ class TestModelWithPreprocCollectionArgs(nn.Module):
         ebc_out = self.ebc(modified_idlist_features[0])
         weighted_ebc_out = self.weighted_ebc(modified_idscore_features[0])
 
-        pred = torch.cat([ebc_out.values(), weighted_ebc_out.values()], dim=1)
-        return pred.sum(), pred
+        ebc_values = ebc_out.values()
+        weighted_ebc_values = weighted_ebc_out.values()
+        loss = ebc_values.sum() + weighted_ebc_values.sum()
+        pred = torch.cat([ebc_values, weighted_ebc_values], dim=1)
+        return loss, pred
 
 
 class TestNegSamplingModule(torch.nn.Module):
@@ -2282,33 +2415,36 @@ class TestNegSamplingModule(torch.nn.Module):
             ModelInput
         """
 
-        # merge extra input
-        modified_input = copy.deepcopy(input)
+        # merge extra input; every field is rebuilt, so the input is not copied
 
         # dim=0 (batch dimensions) increases by self._extra_input.float_features.shape[0]
-        modified_input.float_features = torch.concat(
-            (modified_input.float_features, self._extra_input.float_features), dim=0
+        float_features = torch.cat(
+            (input.float_features, self._extra_input.float_features), dim=0
         )
 
         # stride will be same but features will be joined
-        assert isinstance(modified_input.idlist_features, KeyedJaggedTensor)
+        assert isinstance(input.idlist_features, KeyedJaggedTensor)
         assert isinstance(self._extra_input.idlist_features, KeyedJaggedTensor)
-        modified_input.idlist_features = KeyedJaggedTensor.concat(
-            [modified_input.idlist_features, self._extra_input.idlist_features]
+        idlist_features = KeyedJaggedTensor.concat(
+            [input.idlist_features, self._extra_input.idlist_features]
         )
+        idscore_features = input.idscore_features
         if self._extra_input.idscore_features is not None:
             # stride will be smae but features will be joined
-            modified_input.idscore_features = KeyedJaggedTensor.concat(
+            idscore_features = KeyedJaggedTensor.concat(
                 # pyre-ignore
-                [modified_input.idscore_features, self._extra_input.idscore_features]
+                [idscore_features, self._extra_input.idscore_features]
             )
 
         # dim=0 (batch dimensions) increases by self._extra_input.input_label.shape[0]
-        modified_input.label = torch.concat(
-            (modified_input.label, self._extra_input.label), dim=0
-        )
+        label = torch.cat((input.label, self._extra_input.label), dim=0)
 
-        return modified_input
+        return ModelInput(
+            float_features=float_features,
+            idlist_features=idlist_features,
+            idscore_features=idscore_features,
+            label=label,
+        )
 
 
 class TestPositionWeightedPreprocModule(torch.nn.Module):
@@ -2341,9 +2477,13 @@ class TestPositionWeightedPreprocModule(torch.nn.Module):
         Returns:
             ModelInput
         """
-        modified_input = copy.deepcopy(input)
-        modified_input.idlist_features = self.fp_proc(modified_input.idlist_features)
-        return modified_input
+        # Only idlist_features changes, so the other fields are shared, not copied.
+        return ModelInput(
+            float_features=input.float_features,
+            idlist_features=self.fp_proc(input.idlist_features),
+            idscore_features=input.idscore_features,
+            label=input.label,
+        )
 
 
 class TestSparseArchZCH(nn.Module):
@@ -2369,6 +2509,9 @@ class TestSparseArchZCH(nn.Module):
         TestSparseArch()
     """
 
+    INPUT_HASH_SIZE = 4000
+    EVICTION_INTERVAL = 1000
+
     def __init__(
         self,
         tables: List[EmbeddingBagConfig],
@@ -2379,22 +2522,7 @@ class TestSparseArchZCH(nn.Module):
         super().__init__()
         self._return_remapped = return_remapped
 
-        mc_modules = {}
-        for table in tables:
-            mc_modules[table.name] = MCHManagedCollisionModule(
-                zch_size=table.num_embeddings,
-                input_hash_size=4000,
-                device=device,
-                # TODO: If eviction interval is set to
-                # a low number (e.g. 2), semi-sync pipeline test will
-                # fail with in-place modification error during
-                # loss.backward(). This is because during semi-sync training,
-                # we run embedding module forward after autograd graph
-                # is constructed, but if MCH eviction happens, the
-                # variable used in autograd will have been modified
-                eviction_interval=1000,
-                eviction_policy=DistanceLFU_EvictionPolicy(),
-            )
+        mc_modules = self._build_mc_modules(tables, device)
 
         self.ebc: ManagedCollisionEmbeddingBagCollection = (
             ManagedCollisionEmbeddingBagCollection(
@@ -2412,16 +2540,7 @@ class TestSparseArchZCH(nn.Module):
 
         self.weighted_ebc: Optional[ManagedCollisionEmbeddingBagCollection] = None
         if weighted_tables:
-            weighted_mc_modules = {}
-            for table in weighted_tables:
-                weighted_mc_modules[table.name] = MCHManagedCollisionModule(
-                    zch_size=table.num_embeddings,
-                    input_hash_size=4000,
-                    device=device,
-                    # TODO: Support MCH evictions during semi-sync
-                    eviction_interval=1000,
-                    eviction_policy=DistanceLFU_EvictionPolicy(),
-                )
+            weighted_mc_modules = self._build_mc_modules(weighted_tables, device)
             self.weighted_ebc: ManagedCollisionEmbeddingBagCollection = (
                 ManagedCollisionEmbeddingBagCollection(
                     EmbeddingBagCollection(
@@ -2437,6 +2556,28 @@ class TestSparseArchZCH(nn.Module):
                 )
             )
 
+    @staticmethod
+    def _build_mc_modules(
+        tables: List[EmbeddingBagConfig], device: torch.device
+    ) -> Dict[str, ManagedCollisionModule]:
+        return {
+            table.name: MCHManagedCollisionModule(
+                zch_size=table.num_embeddings,
+                input_hash_size=TestSparseArchZCH.INPUT_HASH_SIZE,
+                device=device,
+                # TODO: If eviction interval is set to
+                # a low number (e.g. 2), semi-sync pipeline test will
+                # fail with in-place modification error during
+                # loss.backward(). This is because during semi-sync training,
+                # we run embedding module forward after autograd graph
+                # is constructed, but if MCH eviction happens, the
+                # variable used in autograd will have been modified
+                eviction_interval=TestSparseArchZCH.EVICTION_INTERVAL,
+                eviction_policy=DistanceLFU_EvictionPolicy(),
+            )
+            for table in tables
+        }
+
     def forward(
         self,
         features: KeyedJaggedTensor,
@@ -2479,30 +2620,20 @@ class TestMixedSequenceOverArch(nn.Module):
         if device is None:
             device = torch.device("cpu")
 
-        # Calculate dimensions
-        dense_dim = 8
-        ebc_dim = sum(
-            [table.embedding_dim * len(table.feature_names) for table in ebc_tables]
-        )
-        ec_dim = sum(
-            [
-                table.embedding_dim * len(table.feature_names) * max_sequence_length
-                for table in ec_tables
-            ]
+        # Calculate dimensions: the 8 dense outputs and the pooled embeddings
+        # come from the shared over-arch helper, plus the flattened sequences.
+        _, _, in_features = _over_arch_dims(
+            _tables_key(ebc_tables), _tables_key(weighted_tables)
         )
-        weighted_dim = sum(
-            [
-                table.embedding_dim * len(table.feature_names)
-                for table in weighted_tables
-            ]
-        )
-
-        in_features = dense_dim + ebc_dim + ec_dim + weighted_dim
+        for table in ec_tables:
+            in_features += (
+                table.embedding_dim * table.num_features() * max_sequence_length
+            )
 
         self.linear = nn.Linear(in_features=in_features, out_features=16, device=device)
 
     def forward(self, dense: torch.Tensor, sparse: torch.Tensor) -> torch.Tensor:
-        return self.linear(torch.cat([dense, sparse], dim=1))
+        return _split_linear(self.linear, dense, sparse)
 
 
 class TestMixedEmbeddingSparseArch(TestSparseNNBase, CopyableMixin):
@@ -2543,14 +2674,21 @@ class TestMixedEmbeddingSparseArch(TestSparseNNBase, CopyableMixin):
 
         ebc_tables: List[EmbeddingBagConfig] = []
         ec_tables: List[EmbeddingConfig] = []
+        # feature names are collected in the same pass that splits the tables
+        ebc_features: List[str] = []
+        ec_features: List[str] = []
+        all_features: List[str] = []
 
         for table in tables:
             if isinstance(table, EmbeddingBagConfig):
                 ebc_tables.append(table)
+                ebc_features.extend(table.feature_names)
             elif isinstance(table, EmbeddingConfig):
                 ec_tables.append(table)
+                ec_features.extend(table.feature_names)
             else:
                 raise ValueError(f"Unsupported table type: {type(table)}")
+            all_features.extend(table.feature_names)
 
         self.ebc: Optional[EmbeddingBagCollection] = None
         if ebc_tables:
@@ -2567,25 +2705,16 @@ class TestMixedEmbeddingSparseArch(TestSparseNNBase, CopyableMixin):
             )
             self.ec_embedding_dim = self.ec.embedding_dim()  # pyre-ignore[4, 16]
 
-        self._ebc_features: List[str] = (
-            [feature for table in ebc_tables for feature in table.feature_names]
-            if ebc_tables
-            else []
-        )
-
-        self._ec_features: List[str] = (
-            [feature for table in ec_tables for feature in table.feature_names]
-            if ec_tables
-            else []
-        )
+        self._ebc_features: List[str] = ebc_features
+        self._ec_features: List[str] = ec_features
+        # (ebc, ec) permute indices per input key order, see _feature_perms
+        self._perm_cache: Dict[Tuple[str, ...], Tuple[List[int], List[int]]] = {}
 
         embedding_names = (
             list(embedding_groups.values())[0] if embedding_groups else None
         )
         self._embedding_names: List[str] = (
-            embedding_names
-            if embedding_names
-            else [feature for table in tables for feature in table.feature_names]
+            embedding_names if embedding_names else all_features
         )
 
         self.dense = TestDenseArch(num_float_features, dense_device)
@@ -2600,7 +2729,7 @@ class TestMixedEmbeddingSparseArch(TestSparseNNBase, CopyableMixin):
     ) -> Union[torch.Tensor, Tuple[torch.Tensor, torch.Tensor]]:
         dense_r = self.dense(input.float_features)
         over_r = self.over(dense_r, sparse_output)
-        pred = torch.sigmoid(torch.mean(over_r, dim=1)) + self.dummy_ones
+        pred = torch.mean(over_r, dim=1).sigmoid_() + self.dummy_ones
         if self.training:
             return (
                 torch.nn.functional.binary_cross_entropy_with_logits(pred, input.label),
@@ -2615,6 +2744,21 @@ class TestMixedEmbeddingSparseArch(TestSparseNNBase, CopyableMixin):
     ) -> Union[torch.Tensor, Tuple[torch.Tensor, torch.Tensor]]:
         return self.dense_forward(input, self.sparse_forward(input))
 
+    def _feature_perms(self, keys: List[str]) -> Tuple[List[int], List[int]]:
+        """
+        Returns the indices of the EBC and EC features within `keys`, computed
+        once per input key order.
+        """
+        keys_key = tuple(keys)
+        perms = self._perm_cache.get(keys_key)
+        if perms is None:
+            perms = (
+                [keys.index(feature) for feature in self._ebc_features],
+                [keys.index(feature) for feature in self._ec_features],
+            )
+            self._perm_cache[keys_key] = perms
+        return perms
+
     def sparse_forward(
         self,
         input: ModelInput,
@@ -2632,51 +2776,47 @@ class TestMixedEmbeddingSparseArch(TestSparseNNBase, CopyableMixin):
         """
         features = input.idlist_features
         batch_size = input.float_features.size(0)
-        ebc_embeddings = torch.empty(0)
-        ec_embeddings = torch.empty(0)
+        ebc_embeddings: Optional[torch.Tensor] = None
+        ebc_perm, ec_perm = self._feature_perms(features.keys())
 
         # Process EmbeddingBagCollection features
         if self.ebc is not None and self._ebc_features:
             # Create a new KJT with only the features needed for EBC
-            ebc_jt_dict = {feature: features[feature] for feature in self._ebc_features}
-            ebc_features = KeyedJaggedTensor.from_jt_dict(ebc_jt_dict)
+            ebc_features = features.permute(ebc_perm)
             ebc_result = self.ebc(ebc_features)  # pyre-ignore[29]
             ebc_embeddings = ebc_result.values()
 
         # Process EmbeddingCollection features
         if self.ec is not None and self._ec_features:
             # Create a new KJT with only the features needed for EC
-            ec_jt_dict = {feature: features[feature] for feature in self._ec_features}
-            ec_features = KeyedJaggedTensor.from_jt_dict(ec_jt_dict)
+            ec_features = features.permute(ec_perm)
             ec_result = self.ec(ec_features)  # pyre-ignore[29]
-            padded_embeddings = [
-                torch.ops.fbgemm.jagged_2d_to_dense(
-                    values=ec_result[e].values(),
-                    offsets=ec_result[e].offsets(),
-                    max_sequence_length=20,
-                ).view(-1, 20 * self.ec_embedding_dim)
-                for e in self._ec_features
-            ]
-
-            def _post_ec_forward(
-                padded_embeddings: List[torch.Tensor], batch_size: Optional[int] = None
-            ) -> torch.Tensor:
-                if batch_size is None or padded_embeddings[0].size(0) == batch_size:
-                    return torch.cat(
-                        padded_embeddings,
-                        dim=1,
-                    )
-                else:
-                    seq_emb = torch.cat(padded_embeddings, dim=1)
-                    ec_values = torch.zeros(
-                        batch_size,
-                        seq_emb.size(1),
-                        dtype=seq_emb.dtype,
-                        device=seq_emb.device,
-                    )
-                    ec_values[: seq_emb.size(0), :] = seq_emb
-                    return ec_values
-
-            ec_embeddings = _post_ec_forward(padded_embeddings, batch_size)
+            ec_jts = [ec_result[e] for e in self._ec_features]
+            # pad every feature with a single jagged_2d_to_dense over their
+            # feature-major rows, then lay the feature blocks out per sample
+            padded = torch.ops.fbgemm.jagged_2d_to_dense(
+                values=torch.cat([jt.values() for jt in ec_jts]),
+                offsets=torch.ops.fbgemm.asynchronous_complete_cumsum(
+                    torch.cat([jt.lengths() for jt in ec_jts])
+                ),
+                max_sequence_length=20,
+            )
+            num_features = len(ec_jts)
+            seq_width = 20 * self.ec_embedding_dim
+            num_rows = padded.size(0) // num_features
+            ebc_width = ebc_embeddings.size(1) if ebc_embeddings is not None else 0
+
+            # write the ebc and ec blocks straight into the (batch_size padded)
+            # output rather than concatenating and padding afterwards
+            output = padded.new_empty(
+                (batch_size, ebc_width + num_features * seq_width)
+            )
+            if ebc_embeddings is not None:
+                output[:, :ebc_width].copy_(ebc_embeddings)
+            output[:num_rows, ebc_width:].view(num_rows, num_features, seq_width).copy_(
+                padded.view(num_features, num_rows, seq_width).transpose(0, 1)
+            )
+            output[num_rows:, ebc_width:].zero_()
+            return output
 
-        return torch.cat([ebc_embeddings, ec_embeddings], dim=1)
+        return ebc_embeddings if ebc_embeddings is not None else torch.empty(0)
@@ -37,9 +37,8 @@ def compute_mse(
 def compute_rmse(
     error_sum: torch.Tensor, weighted_num_samples: torch.Tensor
 ) -> torch.Tensor:
-    return torch.where(
-        weighted_num_samples == 0.0, 0.0, torch.sqrt(error_sum / weighted_num_samples)
-    ).double()
+    # sqrt(0) == 0, so taking the root of the mse keeps the empty-weight case
+    return torch.sqrt(compute_mse(error_sum, weighted_num_samples))
 
 
 def compute_r_squared(
@@ -58,21 +57,31 @@ def compute_r_squared(
 def compute_error_sum(
     labels: torch.Tensor, predictions: torch.Tensor, weights: torch.Tensor
 ) -> torch.Tensor:
-    predictions = predictions.double()
-    return torch.sum(weights * torch.square(labels - predictions), dim=-1)
+    # square the error in the input precision and only accumulate in double
+    return torch.sum(
+        weights * torch.square(labels - predictions), dim=-1, dtype=torch.double
+    )
 
 
 def get_mse_states(
     labels: torch.Tensor,
     predictions: torch.Tensor,
     weights: torch.Tensor,
+    include_r_squared: bool = True,
 ) -> Dict[str, torch.Tensor]:
-    return {
+    states = {
         "error_sum": compute_error_sum(labels, predictions, weights),
         "weighted_num_samples": torch.sum(weights, dim=-1),
-        "label_sum": torch.sum(weights * labels, dim=-1),
-        "label_squared_sum": torch.sum(weights * torch.square(labels), dim=-1),
     }
+    if include_r_squared:
+        # weights * labels ** 2 == (weights * labels) * labels, so both label
+        # statistics reduce the same weighted labels
+        weighted_labels = weights * labels
+        states["label_sum"] = torch.sum(weighted_labels, dim=-1, dtype=torch.double)
+        states["label_squared_sum"] = torch.sum(
+            weighted_labels * labels, dim=-1, dtype=torch.double
+        )
+    return states
 
 
 class MSEMetricComputation(RecMetricComputation):
@@ -105,20 +114,22 @@ class MSEMetricComputation(RecMetricComputation):
             dist_reduce_fx="sum",
             persistent=True,
         )
-        self._add_state(
-            "label_sum",
-            torch.zeros(self._n_tasks, dtype=torch.double),
-            add_window_state=True,
-            dist_reduce_fx="sum",
-            persistent=include_r_squared,
-        )
-        self._add_state(
-            "label_squared_sum",
-            torch.zeros(self._n_tasks, dtype=torch.double),
-            add_window_state=True,
-            dist_reduce_fx="sum",
-            persistent=include_r_squared,
-        )
+        # the label statistics only feed r_squared
+        if include_r_squared:
+            self._add_state(
+                "label_sum",
+                torch.zeros(self._n_tasks, dtype=torch.double),
+                add_window_state=True,
+                dist_reduce_fx="sum",
+                persistent=True,
+            )
+            self._add_state(
+                "label_squared_sum",
+                torch.zeros(self._n_tasks, dtype=torch.double),
+                add_window_state=True,
+                dist_reduce_fx="sum",
+                persistent=True,
+            )
 
     def update(
         self,
@@ -132,70 +143,70 @@ class MSEMetricComputation(RecMetricComputation):
             raise RecMetricException(
                 "Inputs 'predictions' and 'weights' should not be None for MSEMetricComputation update"
             )
-        states = get_mse_states(labels, predictions, weights)
+        states = get_mse_states(
+            labels, predictions, weights, include_r_squared=self._include_r_squared
+        )
         num_samples = predictions.shape[-1]
         for state_name, state_value in states.items():
             state = getattr(self, state_name)
             state += state_value
             self._aggregate_window_state(state_name, state_value, num_samples)
 
+    def _lifetime_and_window(self, state_name: str) -> torch.Tensor:
+        return torch.stack(
+            [
+                cast(torch.Tensor, getattr(self, state_name)),
+                self.get_window_state(state_name),
+            ]
+        )
+
     def _compute(self) -> List[MetricComputationReport]:
+        # lifetime and window states are stacked so each statistic is computed
+        # for both prefixes at once; rmse is the root of the mse
+        error_sum = self._lifetime_and_window(ERROR_SUM)
+        weighted_num_samples = self._lifetime_and_window(WEIGHTED_NUM_SAMPES)
+        mse = compute_mse(error_sum, weighted_num_samples)
+        rmse = torch.sqrt(mse)
         reports = [
             MetricComputationReport(
                 name=MetricName.MSE,
                 metric_prefix=MetricPrefix.LIFETIME,
-                value=compute_mse(
-                    cast(torch.Tensor, self.error_sum),
-                    cast(torch.Tensor, self.weighted_num_samples),
-                ),
+                value=mse[0],
             ),
             MetricComputationReport(
                 name=MetricName.RMSE,
                 metric_prefix=MetricPrefix.LIFETIME,
-                value=compute_rmse(
-                    cast(torch.Tensor, self.error_sum),
-                    cast(torch.Tensor, self.weighted_num_samples),
-                ),
+                value=rmse[0],
             ),
             MetricComputationReport(
                 name=MetricName.MSE,
                 metric_prefix=MetricPrefix.WINDOW,
-                value=compute_mse(
-                    self.get_window_state(ERROR_SUM),
-                    self.get_window_state(WEIGHTED_NUM_SAMPES),
-                ),
+                value=mse[1],
             ),
             MetricComputationReport(
                 name=MetricName.RMSE,
                 metric_prefix=MetricPrefix.WINDOW,
-                value=compute_rmse(
-                    self.get_window_state(ERROR_SUM),
-                    self.get_window_state(WEIGHTED_NUM_SAMPES),
-                ),
+                value=rmse[1],
             ),
         ]
 
         if self._include_r_squared:
+            r_squared = compute_r_squared(
+                error_sum,
+                weighted_num_samples,
+                self._lifetime_and_window(LABEL_SUM),
+                self._lifetime_and_window(LABEL_SQUARED_SUM),
+            )
             reports += [
                 MetricComputationReport(
                     name=MetricName.R_SQUARED,
                     metric_prefix=MetricPrefix.LIFETIME,
-                    value=compute_r_squared(
-                        cast(torch.Tensor, self.error_sum),
-                        cast(torch.Tensor, self.weighted_num_samples),
-                        cast(torch.Tensor, self.label_sum),
-                        cast(torch.Tensor, self.label_squared_sum),
-                    ),
+                    value=r_squared[0],
                 ),
                 MetricComputationReport(
                     name=MetricName.R_SQUARED,
                     metric_prefix=MetricPrefix.WINDOW,
-                    value=compute_r_squared(
-                        self.get_window_state(ERROR_SUM),
-                        self.get_window_state(WEIGHTED_NUM_SAMPES),
-                        self.get_window_state(LABEL_SUM),
-                        self.get_window_state(LABEL_SQUARED_SUM),
-                    ),
+                    value=r_squared[1],
                 ),
             ]
 